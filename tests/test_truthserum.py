@@ -0,0 +1,100 @@
+import os
+import sys
+import timeit
+
+import pytest
+
+# The contract imports the GenLayer SDK, which only ships with GenVM / GenLayer Studio
+# (the "genlayer" name on PyPI is an empty placeholder), so skip cleanly without it.
+genlayer = pytest.importorskip("genlayer", reason="requires the GenLayer SDK")
+if not hasattr(genlayer, "gl"):
+    pytest.skip("requires the GenLayer SDK, not the PyPI placeholder", allow_module_level=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from TruthSerum import TruthSerum  # noqa: E402
+
+
+def html_to_text(html: str) -> str:
+    return TruthSerum._html_to_text(None, html)
+
+
+def test_html_to_text_strips_markup():
+    html = (
+        "<html><head><style>a{}</style><SCRIPT type=x>var x='<p>';</script ></head>"
+        "<body>\n  <h1>Title &amp; more</h1>\n\n<p>a < b</p><!-- note --></body></html>"
+    )
+    assert html_to_text(html) == "Title & more\na < b"
+
+
+def test_html_to_text_unclosed_constructs_consume_rest():
+    assert html_to_text("x<!-- never closed") == "x"
+    assert html_to_text("x<script>never closed") == "x"
+    assert html_to_text("x<b never closed") == "x"
+
+
+def per_call_seconds(html: str) -> float:
+    timer = timeit.Timer(lambda: html_to_text(html))
+    number, _ = timer.autorange()
+    return min(timer.repeat(3, number)) / number
+
+
+@pytest.mark.parametrize("unit", ["<!--", "<script>", "<style>", "<a", "<"])
+def test_html_to_text_scales_linearly_on_hostile_input(unit):
+    # 4x the input should cost ~4x (linear), not ~16x (quadratic); both sizes stay
+    # under _TEXT_SCAN_LIMIT so the cap does not mask the growth.
+    small = per_call_seconds(unit * 10000)
+    large = per_call_seconds(unit * 40000)
+    assert large < 8 * small
+
+
+def test_cache_key_covers_candidate_links():
+    def key(links):
+        prompt = TruthSerum._build_prompt(None, "https://news.example/x", "same text", links)
+        return TruthSerum._cache_key(None, prompt)
+
+    assert key(["https://a.com"]) != key(["https://b.com"])
+    assert key(["https://a.com"]) == key(["https://a.com"])
+
+
+@pytest.mark.parametrize("url", [
+    "http://localhost/x",
+    "https://LOCALHOST:8080/x",
+    "http://user@127.0.0.1/",
+    "http://a@b@localhost/",
+    "http://[::1]/",
+    "http://0.0.0.0",
+    "http://localhost\\@evil.com/",
+    "http://localhost\\x@evil.com",
+    "http://localhost./",
+    "http://LOCALHOST./x",
+    "http://127.0.0.1./",
+    "http://0.0.0.0./",
+    "http://127.0.0.2/",
+    "http://app.localhost/",
+    "http://[::ffff:127.0.0.1]/",
+    "http://[::127.0.0.1]/",
+    "http://[::]/",
+    "http://%6c%6fcalhost/",
+    "http://\uff4c\uff4f\uff43\uff41\uff4c\uff48\uff4f\uff53\uff54/",
+    "http://127.1/",
+    "http://2130706433/",
+    "http://0x7f.0.0.1/",
+    "http://0177.0.0.1/",
+])
+def test_guardrails_block_local_hosts(url):
+    with pytest.raises(ValueError, match="Localhost"):
+        TruthSerum._basic_url_guardrails(None, url)
+
+
+@pytest.mark.parametrize("url", [
+    "https://evil.com/?next=localhost",
+    "https://localhost.example.com/",
+    "https://example.com#@localhost",
+    "https://8.8.8.8/",
+    "http://[2001:db8::1]/",
+    "http://[::ffff:8.8.8.8]/",
+    "http://1.2.3.4.5/",
+    "https://0x7f.example.com/",
+])
+def test_guardrails_allow_public_hosts(url):
+    TruthSerum._basic_url_guardrails(None, url)